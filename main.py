@@ -8,10 +8,23 @@ import argparse
 import random
 import string
 import itertools
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 DICE_LIST = 'dice.dat'
 NUM_DICE = 16
 NUM_DICE_FACES = 6
+# Row and column offsets of the neighbors for every neighbor mode.
+NEIGHBOR_OFFSETS = {
+    'all': ((-1, 0), (0, -1), (1, 0), (0, 1),
+            (-1, -1), (-1, 1), (1, 1), (1, -1)),
+    'no_diag': ((-1, 0), (0, -1), (1, 0), (0, 1)),
+}
+# Search arrays of a worker process, set by init_search_worker.
+worker_search_arrays = None
+# Points per word length, the last entry also counts for longer words.
+WORD_POINTS = (1, 1, 1, 1, 1, 2, 3, 5, 11)
 
 class clr:
     """Colors to be used for printing."""
@@ -20,22 +33,9 @@ class clr:
     RST = '\033[0m'
 
 
-def get_letter(board, cell):
-    """Retrieve letter at cell's position."""
-    return board[cell[0]][cell[1]]
-
 def get_points(word):
     """Assign a Boggle point score to a word."""
-    if len(word) <= 4:
-        return 1
-    elif len(word) == 5:
-        return 2
-    elif len(word) == 6:
-        return 3
-    elif len(word) == 7:
-        return 5
-    elif len(word) >= 8:
-        return 11
+    return WORD_POINTS[min(len(word), len(WORD_POINTS) - 1)]
 
 def get_score(words):
     """Get the total score for this game."""
@@ -45,46 +45,93 @@ def get_score(words):
 
     return score
 
-def get_valid_neighbors(args, board, cur_path):
-    """Retrieve all valid neighbor cell indices."""
-    if args.neighbors == 'all':
-        offsets = [(-1, 0), (0, -1), (1, 0), (0, 1),
-                   (-1, -1), (-1, 1), (1, 1), (1, -1)]
-    elif args.neighbors == 'no_diag':
-        offsets = [(-1, 0), (0, -1), (1, 0), (0, 1)]
-
-    cur_cell = cur_path[-1]
-
-    valid_neighbor_cells = []
-    for offset in offsets:
-        neighbor_cell = (cur_cell[0] + offset[0], cur_cell[1] + offset[1])
-
-        # A neighbor cell is valid if it is within bounds
-        # and if it has not been used in the current word path so far.
-        if (neighbor_cell[0] >= 0 and neighbor_cell[0] < len(board)
-                and neighbor_cell[1] >= 0 and neighbor_cell[1] < len(board)
-                and neighbor_cell not in cur_path):
-            valid_neighbor_cells.append(neighbor_cell)
-
-    return valid_neighbor_cells
-
-def construct_lookup(args):
-    """Construct lookup dictionaries."""
-    num_letters = args.size*args.size
-
-    # All words.
-    words_dict = set()
-    # All words truncated to the n-th character.
-    words_trunc_dict = set()
-    with open(args.wordlist) as file:
-        for line in file:
-            cur_word = line.rstrip()
-            words_dict.add(cur_word)
-
-            for i in range(1, num_letters+1):
-                    words_trunc_dict.add(cur_word[:i])
-
-    return words_dict, words_trunc_dict
+def construct_neighbors(args, board_size):
+    """Construct the table of in-bounds neighbor indices for every cell."""
+    offsets = NEIGHBOR_OFFSETS[args.neighbors]
+
+    neighbors = []
+    for i in range(board_size*board_size):
+        row, col = divmod(i, board_size)
+
+        cell_neighbors = []
+        for offset in offsets:
+            neighbor_row = row + offset[0]
+            neighbor_col = col + offset[1]
+
+            if (0 <= neighbor_row < board_size
+                    and 0 <= neighbor_col < board_size):
+                cell_neighbors.append(neighbor_row*board_size + neighbor_col)
+
+        neighbors.append(cell_neighbors)
+
+    return neighbors
+
+def build_trie_arrays(words):
+    """Encode the words as a trie stored in flat integer arrays."""
+    # Every letter that occurs in the words gets a letter code.
+    alphabet = sorted(set(''.join(words)))
+    letter_codes = {letter: code for code, letter in enumerate(alphabet)}
+    num_letters = len(alphabet)
+
+    # The children of node n are stored at children[n*num_letters + c] for
+    # every letter code c, or -1 if there is no such child. Node 0 is the
+    # root, which corresponds to the empty prefix. Every node also stores
+    # its parent and the letter leading to it, to spell out found words.
+    empty_node = array('i', [-1]*num_letters)
+    children = array('i', empty_node)
+    is_word = bytearray(1)
+    parents = array('i', [-1])
+    node_letters = ['']
+    for word in words:
+        node = 0
+        for letter in word:
+            child_idx = node*num_letters + letter_codes[letter]
+            parent = node
+            node = children[child_idx]
+            if node < 0:
+                node = len(is_word)
+                children[child_idx] = node
+                children.extend(empty_node)
+                is_word.append(0)
+                parents.append(parent)
+                node_letters.append(letter)
+
+        is_word[node] = 1
+
+    return children, is_word, parents, node_letters, letter_codes
+
+def spell_word(trie, node):
+    """Spell out the word that ends in the given trie node."""
+    _, _, parents, node_letters, _ = trie
+
+    word = []
+    while node > 0:
+        word.append(node_letters[node])
+        node = parents[node]
+
+    return ''.join(reversed(word))
+
+def construct_lookup(args, letters):
+    """Construct the lookup trie for the words that fit on the board."""
+    # Words longer than the number of cells can never be found. This also
+    # bounds the depth of the search, as the trie has no deeper nodes.
+    num_letters = len(letters)
+
+    with open(args.wordlist, 'rb') as file:
+        all_words = file.read().splitlines()
+
+    # Skip words that contain letters which are not on the board: deleting
+    # all board letters leaves nothing of the other words. Doing this on
+    # the encoded bytes is fast, but can let through words that combine the
+    # bytes of multi-byte letters differently, so check the rest as text.
+    board_bytes = letters.encode()
+    board_letters = dict.fromkeys(map(ord, letters))
+    words = [word.decode() for word in all_words
+             if word and not word.translate(None, board_bytes)]
+    words = [word for word in words
+             if len(word) <= num_letters and not word.translate(board_letters)]
+
+    return build_trie_arrays(words)
 
 def construct_dice():
     """Read dice from the provided dice file."""
@@ -103,13 +150,11 @@ def construct_board(args):
     board = []
     if args.board:
         # Construct board from input.
-        last_size = None
         for row in args.board:
-            if last_size is not None and len(row) != last_size:
+            if len(row) != len(args.board):
                 exit('Error reading board: board must be square')
 
             board.append(list(row.lower()))
-            last_size = len(row)
     else:
         if args.gen == 'random':
             # Construct board randomly.
@@ -135,6 +180,10 @@ def construct_board(args):
 
     return board
 
+def flatten_board(board):
+    """Flatten the board rows into a single string of letters."""
+    return ''.join(''.join(row) for row in board)
+
 def print_board(board, copy=False):
     """Print the board, optionally as copyable string."""
     for i in range(len(board)):
@@ -148,21 +197,26 @@ def print_board(board, copy=False):
 
     print()
 
-def print_path(board, path, word):
-    """Print given path on the board as highlighted ASCII characters."""
-    for i in range(len(board)):
-        for j in range(len(board)):
-            if (i, j) == path[0]:
+def format_path(board, path):
+    """Format given path on the board as highlighted ASCII characters."""
+    board_size = len(board)
+
+    rows = []
+    for i in range(board_size):
+        row = []
+        for j in range(board_size):
+            cell = i*board_size + j
+            if cell == path[0]:
                 # Highlight starting character differently.
-                print(f'{clr.R}{board[i][j].upper()}{clr.RST}', end='')
-            elif (i, j) in path:
-                print(f'{clr.B}{board[i][j].upper()}{clr.RST}', end='')
+                row.append(f'{clr.R}{board[i][j].upper()}{clr.RST} ')
+            elif cell in path:
+                row.append(f'{clr.B}{board[i][j].upper()}{clr.RST} ')
             else:
-                print(f'{board[i][j].upper()}', end='')
+                row.append(f'{board[i][j].upper()} ')
 
-            print(' ', end='')
+        rows.append(''.join(row))
 
-        print()
+    return '\n'.join(rows)
 
 def print_score(sorted_words):
     """Print the overall game score."""
@@ -171,78 +225,171 @@ def print_score(sorted_words):
 
 def print_found_words(args, board, found_words_paths, sorted_words):
     """Print all found words."""
+    # Buffer all output to write it at once.
+    lines = []
     for word in sorted_words:
-        print(f'{word} - {get_points(word)}')
+        lines.append(f'{word} - {get_points(word)}')
 
         if args.display == 'fancy':
-            print_path(board, found_words_paths[word], word)
-            print()
+            lines.append(format_path(board, found_words_paths[word]))
+            lines.append('')
 
     if args.display == 'plain':
-        print()
+        lines.append('')
+
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
 
 def sort_words(args, found_words_paths):
     """Sort the found words."""
     if args.sort == 'abc':
-        sorted_words = sorted(list(found_words_paths))
+        sorted_words = sorted(found_words_paths)
     elif args.sort == 'size':
-        sorted_words = sorted(sorted(list(found_words_paths)), key=lambda x: len(x))
+        sorted_words = sorted(found_words_paths, key=lambda x: (len(x), x))
     elif args.sort == 'none':
         sorted_words = list(found_words_paths)
 
     return sorted_words
 
-def solve_board(args, board, words_dict, words_trunc_dict):
+def search_board(board, neighbors_flat, neighbors_off, children, num_letters,
+                 is_word, start_cells, need_paths):
+    """Run the DFS on integer arrays only, returning the trie nodes and paths
+    of found words.
+
+    The neighbors of cell i are stored in neighbors_flat, starting at
+    neighbors_off[i] up to neighbors_off[i+1]. Board letters are letter
+    codes below num_letters, where negative codes do not occur in the
+    trie. Cells with such letters may not be neighbors, and every starting
+    cell must have a child of the trie root as letter. Paths are only
+    copied if need_paths is set.
+    """
+    num_cells = len(board)
+
+    found_nodes = []
+    found_paths = []
+    # Per depth: the cell, its trie node and the next neighbor to explore.
+    path = [0]*num_cells
+    node_stack = [0]*num_cells
+    iter_stack = [0]*num_cells
+    # Marks the cells that are part of the current word path.
+    visited = bytearray(num_cells)
+    for start in start_cells:
+        depth = 0
+        path[0] = start
+        node_stack[0] = children[board[start]]
+        iter_stack[0] = neighbors_off[start]
+        visited[start] = 1
+        if is_word[node_stack[0]]:
+            found_nodes.append(node_stack[0])
+            if need_paths:
+                found_paths.append(path[:1])
+
+        while depth >= 0:
+            cur_idx = path[depth]
+            k = iter_stack[depth]
+
+            # Backtrack if there are no more options to explore at this depth.
+            if k == neighbors_off[cur_idx + 1]:
+                visited[cur_idx] = 0
+                depth -= 1
+                continue
+
+            iter_stack[depth] = k + 1
+            next_idx = neighbors_flat[k]
+            if visited[next_idx]:
+                continue
+
+            # Check whether we should continue searching from this cell's letter.
+            node = children[node_stack[depth]*num_letters + board[next_idx]]
+            if node < 0:
+                continue
+
+            depth += 1
+            path[depth] = next_idx
+            node_stack[depth] = node
+            iter_stack[depth] = neighbors_off[next_idx]
+            visited[next_idx] = 1
+            if is_word[node]:
+                found_nodes.append(node)
+                if need_paths:
+                    found_paths.append(path[:depth + 1])
+
+    return found_nodes, found_paths
+
+def init_search_worker(*search_arrays):
+    """Store the search arrays in a worker process, to only send them once."""
+    global worker_search_arrays
+    worker_search_arrays = search_arrays
+
+def search_board_worker(start_cells, need_paths):
+    """Run the DFS from the given cells on the arrays of this worker."""
+    return search_board(*worker_search_arrays, start_cells, need_paths)
+
+def solve_board(letters, neighbors, trie, need_paths=True, workers=1):
     """Find all words on the board that are in the dictionary by DFS."""
-    # Each level of the stack contains possible options for the letter
-    # at that position in the word.
-    to_explore_stack = []
-    init_cells = list(itertools.product(range(len(board)), range(len(board))))
-    to_explore_stack.append(init_cells)
+    children, is_word, _, _, letter_codes = trie
+
+    board = array('i', [letter_codes.get(letter, -1) for letter in letters])
+    # Specialize the neighbor table to this board: cells with letters that
+    # are not in the trie can never be part of a word.
+    neighbors_flat = array('i')
+    neighbors_off = array('i', [0])
+    # Cells are explored last to first, both as starting cells and as
+    # neighbors, which determines the order and paths of the found words.
+    for cell_neighbors in neighbors:
+        neighbors_flat.extend([j for j in reversed(cell_neighbors)
+                               if board[j] >= 0])
+        neighbors_off.append(len(neighbors_flat))
+
+    # Only start from cells whose letter starts any word at all.
+    start_cells = [i for i in reversed(range(len(board)))
+                   if board[i] >= 0 and children[board[i]] >= 0]
+
+    search_arrays = (board, neighbors_flat, neighbors_off, children,
+                     len(letter_codes), is_word)
+    if workers > 1 and len(start_cells) > 1:
+        # Searches from different starting cells are independent, so split
+        # them into consecutive chunks to keep the order of the results.
+        chunk_size = -(-len(start_cells) // workers)
+        chunks = [start_cells[i:i + chunk_size]
+                  for i in range(0, len(start_cells), chunk_size)]
+
+        found_nodes = []
+        found_paths = []
+        with ProcessPoolExecutor(workers, initializer=init_search_worker,
+                                 initargs=search_arrays) as executor:
+            results = executor.map(search_board_worker, chunks,
+                                   itertools.repeat(need_paths))
+            for chunk_nodes, chunk_paths in results:
+                found_nodes.extend(chunk_nodes)
+                found_paths.extend(chunk_paths)
+    else:
+        found_nodes, found_paths = search_board(*search_arrays, start_cells,
+                                                need_paths)
+
+    # A word can be found along several paths, but always ends in the same
+    # trie node. Only spell out each word once, keeping its last path.
+    if need_paths:
+        found_nodes_paths = dict(zip(found_nodes, found_paths))
+    else:
+        found_nodes_paths = dict.fromkeys(found_nodes)
 
     # Store all found words and their paths.
     found_words_paths = {}
-    # Store the word path for found words.
-    cur_path = [None]
-    # Allows us to easily construct the current word at any point in time.
-    cur_letters = [None]
-    while to_explore_stack:
-        # Obtain the deepest exploration level so far.
-        cur_cells = to_explore_stack[-1]
-
-        # Backtrack if there are no more options to explore at this depth.
-        if not cur_cells:
-            to_explore_stack.pop()
-            cur_path.pop()
-            cur_letters.pop()
-            continue
-
-        # Get the first cell at this exploration depth.
-        cur_cell = cur_cells.pop()
-        cur_path[-1] = cur_cell
-        cur_letters[-1] = get_letter(board, cur_cell)
-
-        # Check whether we should continue searching from this cell's letter.
-        cur_word = ''.join(cur_letters)
-        if cur_word not in words_trunc_dict:
-            continue
-        elif cur_word in words_dict:
-            found_words_paths[cur_word] = list(cur_path)
-
-        # Get all cells for next exploration depth.
-        neighbor_cells = get_valid_neighbors(args, board, cur_path)
-        if neighbor_cells:
-            to_explore_stack.append(neighbor_cells)
-            cur_path.append(None)
-            cur_letters.append(None)
+    for node, path in found_nodes_paths.items():
+        found_words_paths[spell_word(trie, node)] = path
 
     return found_words_paths
 
 def main(args):
     board = construct_board(args)
-    words_dict, words_trunc_dict = construct_lookup(args)
+    letters = flatten_board(board)
+    neighbors = construct_neighbors(args, len(board))
+    trie = construct_lookup(args, letters)
 
-    found_words_paths = solve_board(args, board, words_dict, words_trunc_dict)
+    found_words_paths = solve_board(letters, neighbors, trie,
+                                    need_paths=args.display == 'fancy',
+                                    workers=args.workers)
     sorted_words = sort_words(args, found_words_paths)
 
     # Print results.
@@ -265,8 +412,9 @@ if __name__ == '__main__':
     parser.add_argument('--display', type=str, default='fancy',
                         choices=['plain', 'fancy'], help='Display method for the found words.')
     parser.add_argument('--neighbors', type=str, default='all',
-                        choices=['all', 'no_diag'], help='Neighbors to use when searching.')
+                        choices=list(NEIGHBOR_OFFSETS), help='Neighbors to use when searching.')
     parser.add_argument('--gen', type=str, default='dice',
                         choices=['dice', 'random'], help='Whether to use game dice or randomly generated letters.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to search the board with.')
 
     main(parser.parse_args())